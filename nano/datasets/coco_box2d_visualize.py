@@ -1,3 +1,5 @@
+import zlib
+
 import numpy as np
 import torch
 import cv2
@@ -9,9 +11,9 @@ def from_tensor_image(x):
     returns:
         np_img: (h, w, bgr)
     """
-    np_img = (x * 255.0).int().numpy()
-    np_img = np_img[::-1].transpose((1, 2, 0))  # CHW to HWC, RGB to BGR, 0~1 to 0~255
-    np_img = np.ascontiguousarray(np_img)
+    # CHW to HWC, RGB to BGR, 0~1 to 0~255, fused on the tensor side
+    # so a single contiguous uint8 copy is made
+    np_img = x.mul(255.0).clamp_(0, 255).byte().permute(1, 2, 0).flip(-1).contiguous().numpy()
     return np_img
 
 
@@ -22,9 +24,9 @@ def from_numpy_image(img):
     returns:
         x: (rgb, h, w)
     """
-    x = img.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
-    x = np.ascontiguousarray(x)
-    x = torch.from_numpy(x).float() / 255.0  # uint8 to float32, 0-255 to 0.0-1.0
+    # torch.from_numpy shares memory, flip copies once,
+    # then HWC to CHW, BGR to RGB, uint8 to float32, 0-255 to 0.0-1.0
+    x = torch.from_numpy(img).flip(-1).permute(2, 0, 1).contiguous().float().div_(255.0)
     return x
 
 
@@ -46,6 +48,10 @@ def rand_default_color(color):
     return color
 
 
+# pregenerated light-color palette, avoids a numpy random draw per box
+_PALETTE = (np.random.default_rng(0).random((256, 3)) * 128 + 128).tolist()
+
+
 def draw_center_point(image, center, color=None, thickness=3, alpha=None):
     """
     draw square pixel-style points on image
@@ -83,13 +89,14 @@ def draw_bounding_box(image, box, color=None, alpha=None):
     return canvas
 
 
-def draw_text_with_background(image, text, x1, y1, color=None, font=cv2.FONT_HERSHEY_SIMPLEX, font_scale=0.3, font_thickness=1, font_color=(0, 0, 0), alpha=None):
+def draw_text_with_background(image, text, x1, y1, color=None, font=cv2.FONT_HERSHEY_SIMPLEX, font_scale=0.3, font_thickness=1, font_color=(0, 0, 0), alpha=None, text_size=None):
     """
     draw labels with auto-fitting background color
     """
     # set image format
     canvas = any_image_format(image)  # CHW BGR 0~255
-    text_size, _ = cv2.getTextSize(text, font, font_scale, font_thickness)
+    if text_size is None:
+        text_size, _ = cv2.getTextSize(text, font, font_scale, font_thickness)
     text_w, text_h = text_size
     if alpha is None:
         cv2.rectangle(canvas, (x1, y1), (x1 + text_w + 2, y1 + text_h + 2), color, -1)
@@ -135,10 +142,22 @@ def draw_bounding_boxes(image, boxes, box_color=None, boxes_label=None, boxes_ce
         assert len(boxes_centers) == len(boxes)
     if alphas is not None:
         assert len(alphas) == len(boxes)
+    # palette colors are keyed by a stable label hash so a class keeps its
+    # color across frames, text sizes are measured once per label
+    label_colors = {}
+    label_sizes = {}
     # draw boxes
     for i, box in enumerate(boxes):
         # set color
-        color = rand_default_color(box_color)
+        if box_color is not None:
+            color = box_color
+        elif boxes_label is not None:
+            text = boxes_label[i]
+            if text not in label_colors:
+                label_colors[text] = _PALETTE[zlib.crc32(text.encode()) % 256]
+            color = label_colors[text]
+        else:
+            color = _PALETTE[i % 256]
         # set alpha
         alpha = None if alphas is None else alphas[i]
         # draw box
@@ -147,7 +166,9 @@ def draw_bounding_boxes(image, boxes, box_color=None, boxes_label=None, boxes_ce
         if boxes_label is not None:
             x1, y1, _, _ = [int(x) for x in box]
             text = boxes_label[i]
-            cv2_img = draw_text_with_background(cv2_img, text, x1, y1, color, alpha=alpha)
+            if text not in label_sizes:
+                label_sizes[text] = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.3, 1)[0]
+            cv2_img = draw_text_with_background(cv2_img, text, x1, y1, color, alpha=alpha, text_size=label_sizes[text])
         # draw center
         if boxes_centers is not None:
             centers = boxes_centers[i]
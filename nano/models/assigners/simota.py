@@ -1,6 +1,6 @@
 import torch
 from torch import nn
-from torch.nn.functional import one_hot, binary_cross_entropy
+from torch.nn.functional import one_hot, logsigmoid
 from torchvision.ops.boxes import box_iou
 from nano.models.assigners.gfocal_loss import quality_focal_loss
 from nano.ops.box2d import completely_box_iou
@@ -69,7 +69,6 @@ class SimOTA(nn.Module):
         self.device = target.device
         pred, grid_mask, stride_mask = input
         match_mask, box_target, obj_target, cls_target = self.assign_batch(pred, target, grid_mask, stride_mask)
-        torch.cuda.empty_cache()
         if self.compute_loss:
             pred = pred.flatten(0, 1)
             box_pred = pred[match_mask, :4]
@@ -88,110 +87,94 @@ class SimOTA(nn.Module):
             stride_mask: N - A
         target: N(collate) - < collate_id, cid, (abs)xyxy >
         """
-        # collect info
-        match_mask = []
-        box_target = []
-        obj_target = []
-        cls_target = []
-        batch_size = pred.size(0)
-        # process per image
-        for bi in range(batch_size):
-            # process batch ----------------------------------------------------------------
-            # get targets & preds batch
-            index_per_image = target[:, 0] == bi
-            target_per_image = target[index_per_image]
-            pred_per_image = pred[bi]
-
-            if target_per_image.size(0) == 0:  # no targets alive
-                box_t = pred_per_image.new_zeros((0, 4))
-                obj_t = pred_per_image.new_zeros(pred_per_image.size(0))
-                cls_t = pred_per_image.new_zeros(pred_per_image.size(0))
-                m = pred_per_image.new_zeros(pred_per_image.size(0)).bool()
-                box_target.append(box_t)
-                obj_target.append(obj_t)
-                cls_target.append(cls_t)
-                match_mask.append(m)
-                continue
-
-            in_box, in_box_center = self.center_sampling(pred_per_image, target_per_image, grid_mask, stride_mask)
-            mp, tp, p_iou = self.dynamic_topk(pred_per_image, target_per_image, in_box, in_box_center)
-
-            # match mask
-            m = in_box.clone()
-            m[in_box] = mp
-
-            # box target
-            box_t = target_per_image[tp, 2:]
-
-            # obj target
-            obj_t = m.clone().float()
-            obj_t[m] *= p_iou[mp]
-
-            # cls target, background = num_classes
-            cls_t = pred_per_image.new_ones(pred_per_image.size(0)) * self.num_classes
-            cls_t[m] = target_per_image[tp, 1].to(cls_t.dtype)
-
-            # collect mask, box_t, obj_t
-            match_mask.append(m)
-            box_target.append(box_t)
-            obj_target.append(obj_t)
-            cls_target.append(cls_t)
-            # batch finished --------------------------------------------------------------
-
-        # collect assigned batch
-        match_mask = torch.cat(match_mask, 0)
-        box_target = torch.cat(box_target, 0)
-        obj_target = torch.cat(obj_target, 0)
-        cls_target = torch.cat(cls_target, 0)
+        # flatten anchors over the batch so a single center_sampling +
+        # dynamic_topk call covers every image at once: the cost matrix is
+        # block-diagonal, cross-image pairs are rejected by a batch-id mask
+        batch_size, num_anchors = pred.size(0), pred.size(1)
+        pred = pred.flatten(0, 1)  # (N*A, no)
+
+        if target.size(0) == 0:  # no targets alive
+            box_target = pred.new_zeros((0, 4))
+            obj_target = pred.new_zeros(pred.size(0))
+            cls_target = pred.new_zeros(pred.size(0))
+            match_mask = pred.new_zeros(pred.size(0)).bool()
+            return match_mask, box_target, obj_target, cls_target
+
+        # tile grid/stride masks over the batch, mark each anchor with its image
+        grid_mask = grid_mask.repeat(1, batch_size, 1)  # (1, N*A, 2)
+        stride_mask = stride_mask.repeat(1, batch_size)  # (1, N*A)
+        batch_ids = torch.arange(batch_size, device=self.device).repeat_interleave(num_anchors)
+        same_batch = target[:, 0:1] == batch_ids.unsqueeze(0)  # (T, N*A)
+
+        in_box, in_box_center = self.center_sampling(target, grid_mask, stride_mask, same_batch)
+        mp, tp, p_iou = self.dynamic_topk(pred, target, in_box, in_box_center, same_batch[:, in_box])
+
+        # match mask
+        match_mask = in_box.clone()
+        match_mask[in_box] = mp
+
+        # box target
+        box_target = target[tp, 2:]
+
+        # obj target
+        obj_target = match_mask.clone().float()
+        obj_target[match_mask] *= p_iou[mp]
+
+        # cls target, background = num_classes
+        cls_target = pred.new_ones(pred.size(0)) * self.num_classes
+        cls_target[match_mask] = target[tp, 1].to(cls_target.dtype)
         return match_mask, box_target, obj_target, cls_target
 
     @torch.no_grad()
-    def center_sampling(self, preds_per_image, targets_per_image, grid_mask, stride_mask):
+    def center_sampling(self, targets, grid_mask, stride_mask, same_batch):
         """
-        perform center sampling for targets.
+        perform center sampling for targets,
+        anchors are flattened over the whole batch,
+        same_batch keeps each target paired with anchors of its own image only.
         returns:
             is_in_boxes_anchor: (A,)
             is_in_boxes_and_center: (T, Am)
         """
         # build match_matrix with shape (num_targets, num_grids)
-        T = targets_per_image.size(0)
-        A = preds_per_image.size(0)
         # set positive samples (anchors inside bbox or 5x5 of box_center)
         # assert center is in box
-        x_centers_per_image = (grid_mask[..., 0] + 0.5).repeat(T, 1) * stride_mask  # (1, na) -> (nt, na)
-        y_centers_per_image = (grid_mask[..., 1] + 0.5).repeat(T, 1) * stride_mask  # (1, na) -> (nt, na)
-        bboxes_x1_per_image = targets_per_image[..., 2].unsqueeze(1).repeat(1, A)  # (nt, 1) -> (nt, na)
-        bboxes_y1_per_image = targets_per_image[..., 3].unsqueeze(1).repeat(1, A)  # (nt, 1) -> (nt, na)
-        bboxes_x2_per_image = targets_per_image[..., 4].unsqueeze(1).repeat(1, A)  # (nt, 1) -> (nt, na)
-        bboxes_y2_per_image = targets_per_image[..., 5].unsqueeze(1).repeat(1, A)  # (nt, 1) -> (nt, na)
-        b_l = x_centers_per_image - bboxes_x1_per_image
-        b_t = y_centers_per_image - bboxes_y1_per_image
-        b_r = bboxes_x2_per_image - x_centers_per_image
-        b_b = bboxes_y2_per_image - y_centers_per_image
-        bbox_deltas = torch.stack([b_l, b_t, b_r, b_b], 2)
-        is_in_boxes = bbox_deltas.min(dim=-1).values > 0.0
-        is_in_boxes_all = is_in_boxes.sum(dim=0) > 0
+        # (1, na) centers broadcast against (nt, 1) box coords -> (nt, na)
+        x_centers = (grid_mask[..., 0] + 0.5) * stride_mask  # (1, na)
+        y_centers = (grid_mask[..., 1] + 0.5) * stride_mask  # (1, na)
+        bboxes_x1 = targets[..., 2:3]  # (nt, 1)
+        bboxes_y1 = targets[..., 3:4]  # (nt, 1)
+        bboxes_x2 = targets[..., 4:5]  # (nt, 1)
+        bboxes_y2 = targets[..., 5:6]  # (nt, 1)
+        b_l = x_centers - bboxes_x1
+        b_t = y_centers - bboxes_y1
+        b_r = bboxes_x2 - x_centers
+        b_b = bboxes_y2 - y_centers
+        is_in_boxes = torch.minimum(torch.minimum(b_l, b_t), torch.minimum(b_r, b_b)) > 0.0
+        is_in_boxes &= same_batch
+        is_in_boxes_all = is_in_boxes.any(dim=0)
         # assert center is in 5x5 in box_center
         center_radius = 2.5
-        bboxes_xc_per_image = (bboxes_x1_per_image + bboxes_x2_per_image) / 2
-        bboxes_yc_per_image = (bboxes_y1_per_image + bboxes_y2_per_image) / 2
-        c_x = (x_centers_per_image - bboxes_xc_per_image).abs()
-        c_y = (y_centers_per_image - bboxes_yc_per_image).abs()
-        center_deltas = torch.stack([c_x, c_y], 2)
-        is_in_centers = center_deltas.max(dim=-1).values < center_radius * stride_mask
-        is_in_centers_all = is_in_centers.sum(dim=0) > 0
+        bboxes_xc = (bboxes_x1 + bboxes_x2) / 2
+        bboxes_yc = (bboxes_y1 + bboxes_y2) / 2
+        c_x = (x_centers - bboxes_xc).abs()
+        c_y = (y_centers - bboxes_yc).abs()
+        is_in_centers = torch.maximum(c_x, c_y) < center_radius * stride_mask
+        is_in_centers &= same_batch
+        is_in_centers_all = is_in_centers.any(dim=0)
         # in boxes and in centers
         is_in_boxes_anchor = is_in_boxes_all | is_in_centers_all
         is_in_boxes_and_center = is_in_boxes[:, is_in_boxes_anchor] & is_in_centers[:, is_in_boxes_anchor]
         return is_in_boxes_anchor, is_in_boxes_and_center
 
     @torch.no_grad()
-    def dynamic_topk(self, input, target, in_box, in_box_center):
+    def dynamic_topk(self, input, target, in_box, in_box_center, same_pair):
         """
         perform dynamic topk algorithm on matched anchors,
         firstly, each target is assigned to k anchors, (according to sum of ranked iou)
         then multiple targets will be purged,
         which means each anchor should have <= 1 targets.
+        same_pair zeroes cross-image (target, anchor) pairs, box coords are
+        per-image so boxes of different images could otherwise overlap.
         returns:
             mp: (P,)   matched anchors (bool)
             tp: (P,)   target index of each matched anchor (long)
@@ -204,41 +187,57 @@ class SimOTA(nn.Module):
         T = target.size(0)
         P = paired.size(0)
 
-        pair_wise_iou = box_iou(target[..., 2:], paired[..., :4])  # (T, P)
+        pair_wise_iou = box_iou(target[..., 2:], paired[..., :4]) * same_pair  # (T, P)
         pair_wise_iou_loss = -torch.log(pair_wise_iou + 1e-8)
 
-        cls_target = one_hot(target[:, 1].to(torch.int64), self.num_classes)
-        cls_target = cls_target.float().unsqueeze(1).repeat(1, P, 1)
-        cls_pred = paired[..., 4:].sigmoid().float().unsqueeze(0).repeat(T, 1, 1)
+        # one-hot targets collapse the summed sigmoid-BCE to an analytic form:
+        # loss(t, p) = -(log_p[c_t] - log_1mp[c_t]) - sum_c log_1mp[c]
+        # so only (P, C) log-sigmoids and a (T, P) gather are materialized,
+        # never the (T, P, C) one-hot/repeat tensors
         with torch.cuda.amp.autocast(enabled=False):
-            pair_wise_cls_loss = binary_cross_entropy(cls_pred, cls_target, reduction="none").sum(-1)  # (T, P)
-
-        cost = pair_wise_cls_loss + 3.0 * pair_wise_iou_loss + 100000.0 * (~in_box_center)
-        del cls_target, cls_pred, pair_wise_iou_loss, pair_wise_cls_loss
+            logits = paired[..., 4:].float()  # (P, C)
+            log_p = logsigmoid(logits)
+            log_1mp = logsigmoid(-logits)
+            sum_log_1mp = log_1mp.sum(-1)  # (P,)
+            tcls = target[:, 1].to(torch.int64)  # (T,)
+            pair_wise_cls_loss = (log_1mp[:, tcls] - log_p[:, tcls]).t() - sum_log_1mp.unsqueeze(0)  # (T, P)
+
+        # accumulate cost in the cls-loss buffer, the out-of-center penalty
+        # stays additive so overflow picks (dynamic k > in-center count)
+        # remain ordered by their real cost
+        cost = pair_wise_cls_loss.add_(pair_wise_iou_loss, alpha=3.0)
+        cost.add_((~in_box_center).to(cost.dtype), alpha=100000.0)
+        # cross-image pairs must never win a topk tie, even for degenerate
+        # targets whose every same-image candidate is penalized
+        cost.masked_fill_(~same_pair, float("inf"))
+        del logits, log_p, log_1mp, sum_log_1mp, pair_wise_iou_loss, pair_wise_cls_loss
 
         # get dynamic topk
         matching_matrix = torch.zeros_like(cost, dtype=torch.uint8).to(self.device)  # (T, P)
         n_candidate_k = min(10, P)
         topk_ious, _ = torch.topk(pair_wise_iou, n_candidate_k, dim=1)
         dynamic_ks = torch.clamp(topk_ious.sum(1).int(), min=1)
-        self.max_topk = float(topk_ious.sum(1).mean().item())  # record dynamic K
-        dynamic_ks = dynamic_ks.tolist()
-
-        # select topk paired pred
-        for t in range(T):
-            _, p = torch.topk(cost[t], k=dynamic_ks[t], largest=False)
-            matching_matrix[t, p] = 1
-        del topk_ious, dynamic_ks, p
-
-        # purge duplicated assignment
-        targets_per_anchor = matching_matrix.sum(0)
-        if (targets_per_anchor > 1).sum() > 0:
-            _, cost_argmin = torch.min(cost[:, targets_per_anchor > 1], dim=0)
-            matching_matrix[:, targets_per_anchor > 1] *= 0
-            matching_matrix[cost_argmin, targets_per_anchor > 1] = 1
+        # record dynamic K as a 0-dim device tensor, readers (progress bar,
+        # tests) format it on demand instead of forcing a D2H sync every step
+        self.max_topk = topk_ious.sum(1).mean()
+
+        # select topk paired pred (batched over targets)
+        max_k = int(dynamic_ks.max())
+        _, topk_index = torch.topk(cost, max_k, dim=1, largest=False)  # (T, max_k)
+        keep = torch.arange(max_k, device=self.device).unsqueeze(0) < dynamic_ks.unsqueeze(1)
+        matching_matrix.scatter_(1, topk_index, keep.to(matching_matrix.dtype))
+        del topk_ious, dynamic_ks, topk_index, keep
+
+        # purge duplicated assignment, branch-free:
+        # anchors matched by more than one target collapse to their argmin-cost
+        # column, the rest keep theirs (no python-side sync, one fused select)
+        multi = matching_matrix.sum(0, dtype=torch.int16) > 1  # (P, )
+        cost_argmin = cost.argmin(dim=0)  # (P, )
+        replacement = one_hot(cost_argmin, T).t().to(matching_matrix.dtype)  # (T, P)
+        matching_matrix = torch.where(multi.unsqueeze(0), replacement, matching_matrix)
 
         # collect results
-        mp = matching_matrix.sum(0) > 0  # (P, )
+        mp = matching_matrix.any(0)  # (P, )
         tp = matching_matrix[:, mp].argmax(0)  # (P, )
         p_iou = pair_wise_iou.max(0).values  # (P, )
         del pair_wise_iou, cost
@@ -12,6 +12,7 @@ class YoloXHead(nn.Module):
         self.reg_convs = nn.ModuleList()
         self.strides = strides
         self.debug = False
+        self._mask_cache = {}
 
         for i in range(len(in_channels)):
             self.stems.append(
@@ -39,11 +40,18 @@ class YoloXHead(nn.Module):
                 )
             )
 
-    def make_grids(self, x):
+    def make_grids(self, x, stride):
+        # grid/stride masks only depend on the feature size,
+        # build once and cache per (stride, h, w) instead of on every forward
         h, w = x.shape[-2:]
-        yv, xv = torch.meshgrid([torch.arange(h), torch.arange(w)])
-        grid = torch.stack((xv, yv), 2).view(1, -1, 2).to(x.device)
-        return grid
+        cached = self._mask_cache.get((stride, h, w))
+        if cached is None or cached[0].device != x.device:
+            yv, xv = torch.meshgrid([torch.arange(h), torch.arange(w)])
+            grid = torch.stack((xv, yv), 2).view(1, -1, 2).to(x.device)
+            stride_mask = torch.tensor(stride).expand(1, h * w).to(x.device)
+            cached = (grid, stride_mask)
+            self._mask_cache[(stride, h, w)] = cached
+        return cached
 
     def forward(self, xs):
         """
@@ -64,28 +72,32 @@ class YoloXHead(nn.Module):
             cls_preds = self.cls_convs[i](x)
             y = torch.cat([reg_preds, cls_preds], dim=1)
 
-            # record stride mask
-            stride_mask = torch.tensor(stride).expand(1, y.size(-2) * y.size(-1)).to(y.device)
-            grid_mask = self.make_grids(y)
+            # record grid & stride mask
+            grid_mask, stride_mask = self.make_grids(y, stride)
             ss.append(stride_mask)
             gs.append(grid_mask)
 
             # output shaped as (N, A, 4+1+c)
-            y = y.flatten(2).permute(0, 2, 1)
-            if not self.training:
-                y = y.sigmoid()
-            else:
-                y[..., :4] = y[..., :4].sigmoid()
-            # ccwh -> xywh
-            y[..., :2] = (y[..., :2] * 7 - 3 + grid_mask) * stride  # +-3.5
-            y[..., 2:4] = torch.exp(y[..., 2:4] * 3) * stride  # max=20*stride
+            ys.append(y.flatten(2).permute(0, 2, 1))
+
+        # concat outputs as (N, A1+A2...+Ai, 4+1+c),
+        # then decode every level with a single set of kernels
+        y = torch.cat(ys, 1)
+        grid_mask = torch.cat(gs, 1)
+        stride_mask = torch.cat(ss, 1)
+        stride = stride_mask.unsqueeze(-1)  # (1, A, 1)
+        if not self.training:
+            y = y.sigmoid()
+        else:
+            y[..., :4] = y[..., :4].sigmoid()
+        # ccwh -> xywh
+        y[..., :2] = (y[..., :2] * 7 - 3 + grid_mask) * stride  # +-3.5
+        y[..., 2:4] = torch.exp(y[..., 2:4] * 3) * stride  # max=20*stride
 
-            # xywh -> xyxy
-            y[..., :2] -= y[..., 2:4] / 2
-            y[..., 2:4] += y[..., :2]
-            ys.append(y)
+        # xywh -> xyxy
+        y[..., :2] -= y[..., 2:4] / 2
+        y[..., 2:4] += y[..., :2]
 
-        # concat outputs as (N, A1+A2...+Ai, 4+1+c)
         if self.training or self.debug:
-            return torch.cat(ys, 1), torch.cat(gs, 1), torch.cat(ss, 1)
-        return torch.cat(ys, 1)
+            return y, grid_mask, stride_mask
+        return y
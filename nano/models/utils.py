@@ -1,4 +1,29 @@
 import torch
+import torch.nn as nn
+
+
+@torch.no_grad()
+def fuse_conv_bn(model):
+    """
+    fold BatchNorm2d into the preceding Conv2d for inference,
+    (conv > bn > act) sequences become (fused conv > identity > act),
+    halving the memory traffic between layers.
+    * call on an eval() model only, returns the model for chaining.
+    """
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for i in range(len(module) - 1):
+            conv, bn = module[i], module[i + 1]
+            if not (isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d)):
+                continue
+            scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+            conv.weight = nn.Parameter(conv.weight * scale.reshape(-1, 1, 1, 1))
+            bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+            conv.bias = nn.Parameter((bias - bn.running_mean) * scale + bn.bias)
+            module[i + 1] = nn.Identity()
+    return model
+
 
 def check_size(model):
     params = 0
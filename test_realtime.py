@@ -169,9 +169,11 @@ def test_yuv(conf_thres, iou_thres, class_names, device="cpu"):
 
 def acquire_model():
     from nano.models.model_zoo.nano_ghost import GhostNano_3x4_m96
+    from nano.models.utils import fuse_conv_bn
 
     model = GhostNano_3x4_m96(num_classes=3)
     model.load_state_dict(torch.load("release/GhostNano_3x4_m96/GhostNano_3x4_m96.pt", map_location="cpu"))
+    model = fuse_conv_bn(model.eval())
     return model
 
 
@@ -0,0 +1,79 @@
+import numpy as np
+from ._layer import CaffeLayer
+
+
+class Slice:
+    def __init__(self, node, constant_dict) -> None:
+        # basic attributes
+        self.node_name = node.name
+        self.input_names = [str(node.input[0])]
+        self.output_names = [str(node.output[0])]
+        # slice attributes, starts/ends/axes/steps come from constant nodes
+        starts = self._fetch(node, constant_dict, 1)
+        ends = self._fetch(node, constant_dict, 2)
+        axes = self._fetch(node, constant_dict, 3, default=[0])
+        steps = self._fetch(node, constant_dict, 4, default=[1])
+        assert len(starts) == 1 and len(ends) == 1 and len(axes) == 1
+        if steps != [1]:
+            raise NotImplementedError("XNNC do not support strided slice")
+        self.start = starts[0]
+        self.end = ends[0]
+        self.axis = axes[0]
+
+    @staticmethod
+    def _fetch(node, constant_dict, i, default=None):
+        if i < len(node.input) and str(node.input[i]) in constant_dict:
+            return [int(x) for x in np.atleast_1d(constant_dict[str(node.input[i])])]
+        return default
+
+    def reshape(self, bottom_shapes):  # -> top_shapes
+        top_shape = list(bottom_shapes[0])
+        self.dim = top_shape[self.axis]
+        # normalize negative / int64-max indices against the real dim
+        if self.start < 0:
+            self.start += self.dim
+        if self.end < 0:
+            self.end += self.dim
+        self.end = min(self.end, self.dim)
+        top_shape[self.axis] = self.end - self.start
+        return [
+            tuple(top_shape),
+        ]
+
+    def shadow_proto(self):
+        # caffe Slice splits the bottom at slice_point(s), keep the requested
+        # segment as the real top and route the rest to unused dummy blobs
+        slice_points = []
+        outputs = []
+        if self.start > 0:
+            slice_points.append(self.start)
+            outputs.append(f"{self.output_names[0]}_slice_head")
+        outputs.append(self.output_names[0])
+        if self.end < self.dim:
+            slice_points.append(self.end)
+            outputs.append(f"{self.output_names[0]}_slice_tail")
+        return CaffeLayer(
+            "Slice",
+            self.node_name,
+            self.input_names,
+            outputs,
+            slice_param=dict(
+                axis=self.axis,
+                slice_point=slice_points,
+            ),
+        )._to_proto()
+
+    def to_proto(self):
+        # XNNC slice layer definition.
+        txt_proto = ""
+        txt_proto += "layer {\n"
+        txt_proto += '  name: "{}"\n'.format(self.node_name)
+        txt_proto += '  type: "CppCustom"\n'
+        txt_proto += '  bottom: "{}"\n'.format(self.input_names[0])
+        txt_proto += '  top: "{}"\n'.format(self.output_names[0])
+        txt_proto += "  cpp_custom_param {\n"
+        txt_proto += '    module: "XnncSlice"\n'
+        txt_proto += '    param_map_str: "axis:{} start:{} end:{}"\n'.format(self.axis, self.start, self.end)
+        txt_proto += "  }\n"
+        txt_proto += "}\n"
+        return txt_proto
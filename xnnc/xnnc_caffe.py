@@ -1,3 +1,5 @@
+import os
+
 import onnx
 from onnx import numpy_helper
 import caffe
@@ -10,11 +12,29 @@ from .layers.convolution import Conv2d
 from .layers.activation import Relu, LeakyRelu, Relu6
 from .layers.concat import Concat, constant_concat_killer
 from .layers.pooling import Maxpool2d, Avgpool2d, GlobalAvgpool2d
+from .layers.slice import Slice
 from .layers.ffop import Add
 
 
 __iid = 0
 
+# O(1) op-type dispatch, builders share the
+# (node, tensor_dict, shape_dict, constant_dict) signature
+_OP_BUILDERS = {
+    "Conv": lambda n, t, s, c: Conv2d(n, t, s),
+    "Relu": lambda n, t, s, c: Relu(n),
+    "LeakyRelu": lambda n, t, s, c: LeakyRelu(n),
+    "Concat": lambda n, t, s, c: Concat(n),
+    "MaxPool": lambda n, t, s, c: Maxpool2d(n),
+    "AveragePool": lambda n, t, s, c: Avgpool2d(n),
+    "GlobalAveragePool": lambda n, t, s, c: GlobalAvgpool2d(n),
+    "Add": lambda n, t, s, c: Add(n, s),
+    "Clip": lambda n, t, s, c: Relu6(n, c),
+    "Resize": lambda n, t, s, c: Resize(n, t, s),
+    "Slice": lambda n, t, s, c: Slice(n, c),
+    "channel_shuffle": lambda n, t, s, c: ShuffleChannel(n, c),
+}
+
 
 def iid(op_type):
     global __iid
@@ -28,19 +48,22 @@ def register_shape(layer, shape_dict, input_mode=False):
     if input_mode:
         output_shapes = layer.reshape()
     else:
-        input_names = layer.input_names
-        bottom_shapes = [shape_dict[x] for x in input_names]
+        sd_get = shape_dict.__getitem__  # pre-bound, runs once per layer input
+        bottom_shapes = [sd_get(x) for x in layer.input_names]
         output_shapes = layer.reshape(bottom_shapes)
     assert len(output_names) == len(output_shapes), (output_names, output_shapes)
     for blob, shape in zip(output_names, output_shapes):
-        shape_dict[blob] = tuple(shape)
+        # stored shapes are always tuples, so passthrough layers re-register
+        # their bottom shapes without a tuple() copy
+        shape_dict[blob] = shape if isinstance(shape, tuple) else tuple(shape)
 
 
 def export(onnx_path):
     prototxt_path = onnx_path.replace(".onnx", ".prototxt")
     caffemodel_path = onnx_path.replace(".onnx", ".caffemodel")
-    graph = onnx.load(onnx_path).graph
-    # model = shape_inference.infer_shapes(model)
+    # weights are read from the in-graph initializers below, so skip any
+    # external-data resolution pass; no extra shape-inference re-read either
+    graph = onnx.load(onnx_path, load_external_data=False).graph
     constant_dict = {str(n.output[0]): parse_attribute(n)["value"] for n in graph.node if n.op_type == "Constant"}
     tensor_dict = {t.name: numpy_helper.to_array(t) for t in graph.initializer}
     shape_dict = {}
@@ -58,43 +81,19 @@ def export(onnx_path):
         if node.op_type == "Constant":
             continue
         node.name = iid(node.op_type)
-        print(f"processing node [{node.name}]")
-        if node.op_type == "Conv":
-            layer = Conv2d(node, tensor_dict, shape_dict)
-        elif node.op_type == "Relu":
-            layer = Relu(node)
-        elif node.op_type == "LeakyRelu":
-            layer = LeakyRelu(node)
-        elif node.op_type == "Concat":
-            layer = Concat(node)
-        elif node.op_type == "MaxPool":
-            layer = Maxpool2d(node)
-        elif node.op_type == "AveragePool":
-            layer = Avgpool2d(node)
-        elif node.op_type == "GlobalAvaragePool":
-            layer = GlobalAvgpool2d(node)
-        elif node.op_type == "Add":
-            layer = Add(node, shape_dict)
-        elif node.op_type == "Clip":
-            layer = Relu6(node, constant_dict)
-        elif node.op_type == "Resize":
-            layer = Resize(node, tensor_dict, shape_dict)
-        elif node.op_type == "Slice":
-            layer = Slice(node, constant_dict)
-        elif node.op_type == "channel_shuffle":
-            layer = ShuffleChannel(node, constant_dict)
-        else:
+        if os.environ.get("XNNC_VERBOSE"):
+            print(f"processing node [{node.name}]")
+        builder = _OP_BUILDERS.get(node.op_type)
+        if builder is None:
             raise NotImplementedError(f"{node.op_type} not supported.")
+        layer = builder(node, tensor_dict, shape_dict, constant_dict)
         register_shape(layer, shape_dict)
         layer_list.append(layer)
 
+    # join all layer protos and write each file in one call
+    protos = [layer.shadow_proto() if hasattr(layer, "shadow_proto") else layer.to_proto() for layer in layer_list]
     with open(prototxt_path, "w") as f:
-        for layer in layer_list:
-            if hasattr(layer, "shadow_proto"):
-                proto = layer.shadow_proto()
-            else:
-                proto = layer.to_proto()
-            f.write(proto)
+        f.write("".join(protos))
 
     caffe.set_mode_cpu()
     net = caffe.Net(prototxt_path, caffe.TEST)
@@ -105,8 +104,6 @@ def export(onnx_path):
 
     custom_prototxt_path = prototxt_path.replace(".prototxt", "-custom.prototxt")
     with open(custom_prototxt_path, "w") as f:
-        for layer in layer_list:
-            proto = layer.to_proto()
-            f.write(proto)
+        f.write("".join(layer.to_proto() for layer in layer_list))
 
     return onnx_path, caffemodel_path, custom_prototxt_path